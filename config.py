@@ -0,0 +1,54 @@
+"""API key lookup shared by the recording scripts."""
+import mmap
+import os
+from pathlib import Path
+
+ZSHENV_PATH = Path.home() / '.zshenv'
+CACHE_DIR = Path.home() / '.cache' / 'voice-type'
+
+def parse_zshenv(name):
+    """Read `export NAME=...` from ~/.zshenv"""
+    key = f'export {name}='.encode()
+    try:
+        with open(ZSHENV_PATH, 'rb') as f, mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ) as m:
+            start = m.find(key)
+            # Only accept matches at the start of a line, e.g. not commented out
+            while start > 0 and m[start - 1] != ord('\n'):
+                start = m.find(key, start + 1)
+            if start < 0:
+                return None
+            end = m.find(b'\n', start)
+            if end < 0:
+                end = len(m)
+            return m[start + len(key):end].strip().strip(b"'\"").decode()
+    except (FileNotFoundError, ValueError):  # An empty file can't be mapped
+        return None
+
+def read_cached_key(name):
+    """Return the cached key unless ~/.zshenv has changed since it was written"""
+    cache_file = CACHE_DIR / name
+    try:
+        cache_mtime = cache_file.stat().st_mtime
+        if ZSHENV_PATH.exists() and ZSHENV_PATH.stat().st_mtime > cache_mtime:
+            return None
+        return cache_file.read_text().strip() or None
+    except FileNotFoundError:
+        return None
+
+def write_cached_key(name, api_key):
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    fd = os.open(CACHE_DIR / name, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(api_key)
+
+def load_api_key(name):
+    """Return an API key from the environment, the key cache or ~/.zshenv"""
+    api_key = os.environ.get(name) or read_cached_key(name)
+    if not api_key:
+        api_key = parse_zshenv(name)
+        if api_key:
+            write_cached_key(name, api_key)
+    if api_key:
+        # Inherited by the daemon and anything it spawns
+        os.environ[name] = api_key
+    return api_key
@@ -0,0 +1,207 @@
+"""Desktop integration shared by the recording scripts.
+
+Talks to i3status, the notification daemon and the X server directly instead
+of forking killall/notify-send/xdotool on every start, stop and transcript.
+"""
+import os
+import signal
+import subprocess
+import threading
+from pathlib import Path
+
+try:
+    from jeepney import DBusAddress, MessageType, new_method_call
+    from jeepney.io.blocking import open_dbus_connection
+except ImportError:  # Fall back to notify-send
+    open_dbus_connection = None
+
+try:
+    from Xlib import X, XK
+    from Xlib.display import Display
+    from Xlib.ext import xtest
+except ImportError:  # Fall back to xdotool
+    Display = None
+
+_i3status = None  # [(pidfd or None, pid)] for every running i3status
+_dbus = None
+_notification_id = 0
+_dbus_lock = threading.Lock()
+_display = None
+_keymap = None  # Character -> (keycode, needs shift)
+_shift_keycode = None
+_numlock_mask = 0
+_x_lock = threading.Lock()
+
+def find_pids(name):
+    """Return the PIDs of all processes whose command name is name"""
+    pids = []
+    for comm in Path('/proc').glob('[0-9]*/comm'):
+        try:
+            if comm.read_text().strip() == name:
+                pids.append(int(comm.parent.name))
+        except (OSError, ValueError):
+            continue
+    return pids
+
+def _open_i3status():
+    """Open a pidfd for every i3status, or keep the bare PID without pidfd support"""
+    handles = []
+    for pid in find_pids('i3status'):
+        try:
+            handles.append((os.pidfd_open(pid), pid))
+        except ProcessLookupError:
+            continue
+        except OSError:
+            # ENOSYS: the kernel predates pidfd_open (Linux 5.3)
+            handles.append((None, pid))
+    return handles
+
+def _close_i3status(handles):
+    for pidfd, _ in handles:
+        if pidfd is not None:
+            os.close(pidfd)
+
+def refresh_i3status():
+    """Send SIGUSR1 to every i3status so it re-reads the recording indicator"""
+    global _i3status
+    # A pidfd keeps pointing at the same process even if its PID is reused
+    for _ in range(2):
+        if not _i3status:
+            _i3status = _open_i3status()
+            if not _i3status:
+                return
+        stale = False
+        for pidfd, pid in _i3status:
+            try:
+                if pidfd is None:
+                    os.kill(pid, signal.SIGUSR1)
+                else:
+                    signal.pidfd_send_signal(pidfd, signal.SIGUSR1)
+            except ProcessLookupError:
+                stale = True
+        if not stale:
+            return
+        # An i3status was restarted, rescan /proc
+        _close_i3status(_i3status)
+        _i3status = None
+
+def notify(summary, body, replace=True):
+    """Show a desktop notification over D-Bus, falling back to notify-send
+
+    Each call replaces the previous notification, so a recording cycle shows a
+    single bubble that updates in place instead of a stack of them. Pass
+    replace=False for errors, so the next status update can't hide them.
+    """
+    global _dbus, _notification_id
+    if open_dbus_connection is not None:
+        with _dbus_lock:
+            try:
+                if _dbus is None:
+                    _dbus = open_dbus_connection(bus='SESSION')
+                address = DBusAddress(
+                    '/org/freedesktop/Notifications',
+                    bus_name='org.freedesktop.Notifications',
+                    interface='org.freedesktop.Notifications',
+                )
+                message = new_method_call(
+                    address, 'Notify', 'susssasa{sv}i',
+                    ('Voice Typing', _notification_id if replace else 0, '', summary, body, [], {}, -1)
+                )
+                reply = _dbus.send_and_get_reply(message, timeout=1)
+                if reply.header.message_type != MessageType.method_return:
+                    # An error reply's body is the message, not a notification ID
+                    raise RuntimeError(reply.body)
+                if replace:
+                    _notification_id = reply.body[0]
+                return
+            except Exception:
+                _dbus = None
+    subprocess.run(['notify-send', summary, body])
+
+def _load_keymap():
+    """Open the X display and precompute keycodes for printable ASCII"""
+    global _display, _keymap, _shift_keycode, _numlock_mask
+    _display = Display()
+    _keymap = {}
+    keysyms = {chr(c): c for c in range(0x20, 0x7f)}  # ASCII keysyms equal their code points
+    keysyms.update({'\n': XK.XK_Return, '\t': XK.XK_Tab, '\b': XK.XK_BackSpace})
+    for char, keysym in keysyms.items():
+        keycode = _display.keysym_to_keycode(keysym)
+        if not keycode:
+            continue
+        if _display.keycode_to_keysym(keycode, 0) == keysym:
+            _keymap[char] = (keycode, False)
+        elif _display.keycode_to_keysym(keycode, 1) == keysym:
+            _keymap[char] = (keycode, True)
+    _shift_keycode = _display.keysym_to_keycode(XK.XK_Shift_L)
+    # NumLock doesn't change the ASCII keys we type, so it must not force the fallback
+    numlock = _display.keysym_to_keycode(XK.XK_Num_Lock)
+    _numlock_mask = 0
+    for index, keycodes in enumerate(_display.get_modifier_mapping()):
+        if numlock and numlock in keycodes:
+            _numlock_mask |= 1 << index
+
+def _modifiers_active():
+    """True if a held modifier or Caps Lock would alter the keys XTest sends"""
+    modifiers = (X.ShiftMask | X.LockMask | X.ControlMask | X.Mod1Mask
+                 | X.Mod2Mask | X.Mod3Mask | X.Mod4Mask | X.Mod5Mask)
+    mask = _display.screen().root.query_pointer().mask
+    return bool(mask & modifiers & ~_numlock_mask)
+
+def _xtest_type(text):
+    """Type text with XTest fake key events; False if any character is unmapped
+    or a modifier is active, so the caller falls back to xdotool"""
+    global Display, _display, _keymap
+    if Display is None:
+        return False
+    if _keymap is None:
+        try:
+            _load_keymap()
+        except Exception:
+            # No usable X display, stop trying
+            Display = None
+            return False
+    if not all(char in _keymap for char in text):
+        return False
+    try:
+        if _modifiers_active():
+            # xdotool --clearmodifiers releases them around the typing
+            return False
+
+        for char in text:
+            keycode, shifted = _keymap[char]
+            if shifted:
+                xtest.fake_input(_display, X.KeyPress, _shift_keycode)
+            xtest.fake_input(_display, X.KeyPress, keycode)
+            xtest.fake_input(_display, X.KeyRelease, keycode)
+            if shifted:
+                xtest.fake_input(_display, X.KeyRelease, _shift_keycode)
+            _display.sync()
+    except Exception:
+        # The connection is broken (e.g. X restarted), reconnect on the next call
+        try:
+            _display.close()
+        except Exception:
+            pass
+        _display = None
+        _keymap = None
+        return False
+    return True
+
+def replace_text(erase_count, text):
+    """Press BackSpace erase_count times, then type text, in the focused window"""
+    with _x_lock:
+        if _xtest_type('\b' * erase_count + text):
+            return
+    # Chain both commands so the fallback costs a single xdotool process
+    cmd = ['xdotool']
+    if erase_count:
+        cmd += ['key', '--delay', '0', '--clearmodifiers', '--repeat', str(erase_count), 'BackSpace']
+    if text:
+        cmd += ['type', '--delay', '0', '--clearmodifiers', text]
+    if len(cmd) > 1:
+        subprocess.run(cmd)
+
+def type_text(text):
+    """Type text into the focused window via XTest, falling back to xdotool"""
+    replace_text(0, text)
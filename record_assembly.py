@@ -1,14 +1,20 @@
 #!/usr/bin/env python3
 import os
 import sys
+import asyncio
 import signal
-import subprocess
 from pathlib import Path
 import assemblyai as aai
+from config import load_api_key
+from desktop import notify, refresh_i3status, type_text
 from datetime import datetime
 import threading
 import time
 
+KEEPALIVE_INTERVAL = 5  # Seconds between silent frames on an armed, idle session
+MAX_IDLE = 600  # Disconnect an armed session after this many idle seconds
+SILENCE = bytes(3200)  # 100ms of PCM16 @ 16kHz mono
+
 def log_time(message):
     """Log message with timestamp"""
     timestamp = datetime.now().strftime('%H:%M:%S.%f')[:-3]
@@ -22,6 +28,8 @@ class TranscriptionManager:
         self.transcriber = None
         self.stream = None
         self.is_running = False
+        self.stopped = threading.Event()
+        self.loop = None
         self.current_text = ""
         
         # Read API key from .zshenv
@@ -34,14 +42,8 @@ class TranscriptionManager:
         aai.settings.api_key = self.api_key
 
     def read_api_key(self):
-        """Read API key from .zshenv file"""
-        zshenv_path = self.home / '.zshenv'
-        if zshenv_path.exists():
-            with open(zshenv_path, 'r') as f:
-                for line in f:
-                    if line.startswith('export ASSEMBLY_API_KEY='):
-                        return line.split('=', 1)[1].strip().strip("'\"")
-        return None
+        """Read API key from the environment or ~/.zshenv"""
+        return load_api_key('ASSEMBLY_API_KEY')
 
     def on_open(self, session_opened: aai.RealtimeSessionOpened):
         """Called when the connection has been established."""
@@ -54,8 +56,11 @@ class TranscriptionManager:
 
         if isinstance(transcript, aai.RealtimeFinalTranscript):
             self.current_text = transcript.text
-            # Type out the final transcript
-            subprocess.run(['xdotool', 'type', '--clearmodifiers', transcript.text + " "])
+            # Type out the final transcript, off the SDK's receiving thread when possible
+            if self.loop:
+                self.loop.call_soon_threadsafe(type_text, transcript.text + " ")
+            else:
+                type_text(transcript.text + " ")
             log_time(f"Final transcript: {transcript.text}")
         else:
             # Update the current partial transcript
@@ -71,6 +76,7 @@ class TranscriptionManager:
         """Called when the connection has been closed."""
         log_time("Session closed")
         self.is_running = False
+        self.stopped.set()
 
     def start_recording(self):
         """Start the transcription stream"""
@@ -81,7 +87,7 @@ class TranscriptionManager:
             self.transcriber = aai.RealtimeTranscriber(
                 on_data=self.on_data,
                 on_error=self.on_error,
-                sample_rate=44_100,
+                sample_rate=16_000,
                 on_open=self.on_open,
                 on_close=self.on_close,
             )
@@ -90,52 +96,40 @@ class TranscriptionManager:
             self.transcriber.connect()
 
             # Open microphone stream
-            self.stream = aai.extras.MicrophoneStream()
+            self.stream = aai.extras.MicrophoneStream(sample_rate=16_000)
             
             # Save the process ID
             self.pid_file.write_text(str(os.getpid()))
             
             # Update i3status
             self.i3status_file.write_text("recording🎤")
-            subprocess.run(['killall', '-USR1', 'i3status'], check=False)
+            refresh_i3status()
             
-            # Start streaming in a separate thread
             self.is_running = True
-            self.stream_thread = threading.Thread(target=self._stream_audio)
-            self.stream_thread.start()
-            
-            # Add timer thread to stop after 2 minutes
-            self.timer_thread = threading.Thread(target=self._stop_after_timeout)
-            self.timer_thread.start()
-            
-            subprocess.run(['notify-send', 'Voice Typing', 'Real-time transcription started'])
+            notify('Voice Typing', 'Real-time transcription started')
             log_time("Transcription started successfully")
+            return True
             
         except Exception as e:
             log_time(f"Error starting transcription: {e}")
-            subprocess.run(['notify-send', 'Voice Typing Error', f"Failed to start transcription: {e}"])
+            notify('Voice Typing Error', f"Failed to start transcription: {e}", replace=False)
             self.stop_recording()
+            return False
 
     def _stream_audio(self):
-        """Stream audio in a separate thread"""
+        """Stream audio; blocks, so it runs in a worker thread"""
         try:
             self.transcriber.stream(self.stream)
         except Exception as e:
             log_time(f"Streaming error: {e}")
             self.stop_recording()
 
-    def _stop_after_timeout(self):
-        """Stop recording after 2 minutes"""
-        time.sleep(120)  # 2 minutes = 120 seconds
-        if self.is_running:
-            log_time("Maximum recording time (2 minutes) reached")
-            self.stop_recording()
-
     def stop_recording(self):
         """Stop the transcription stream"""
         log_time("Stopping transcription")
         
         self.is_running = False
+        self.stopped.set()
         
         if self.transcriber:
             try:
@@ -152,31 +146,168 @@ class TranscriptionManager:
         # Clean up files
         self.pid_file.unlink(missing_ok=True)
         self.i3status_file.unlink(missing_ok=True)
-        subprocess.run(['killall', '-USR1', 'i3status'], check=False)
+        refresh_i3status()
         
-        subprocess.run(['notify-send', 'Voice Typing', 'Transcription stopped'])
+        notify('Voice Typing', 'Transcription stopped')
         log_time("Transcription stopped")
 
+    async def run(self):
+        """Transcribe until SIGTERM, Ctrl-C, the session closing or the 2 minute limit"""
+        self.loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            self.loop.add_signal_handler(signum, self.stopped.set)
+
+        # Connecting and opening the microphone block, keep them off the loop
+        if not await asyncio.to_thread(self.start_recording):
+            return
+
+        streaming = asyncio.create_task(asyncio.to_thread(self._stream_audio))
+        try:
+            await asyncio.wait_for(asyncio.to_thread(self.stopped.wait), timeout=120)
+        except asyncio.TimeoutError:
+            log_time("Maximum recording time (2 minutes) reached")
+        await asyncio.to_thread(self.stop_recording)
+        await streaming
+        self.loop = None
+
+class TranscriptionDaemon(TranscriptionManager):
+    """TranscriptionManager that connects ahead of time, so a toggle only opens the microphone"""
+    def __init__(self):
+        super().__init__()
+        self.active = threading.Event()
+        self.wake = threading.Event()  # Interrupts the idle keep-alive wait
+        self.stream_thread = None
+
+    def arm(self):
+        """Connect a new session ahead of the next toggle"""
+        log_time("Arming session")
+        # The previous session's generator must be done before stopped is cleared
+        if self.stream_thread is not None:
+            self.stream_thread.join()
+            self.stream_thread = None
+
+        transcriber = aai.RealtimeTranscriber(
+            on_data=self.on_data,
+            on_error=self.on_error,
+            sample_rate=16_000,
+            on_open=self.on_open,
+            on_close=self.on_close,
+        )
+        try:
+            transcriber.connect()
+        except Exception:
+            # Leave the daemon disarmed so the next toggle retries
+            self.stopped.set()
+            raise
+        self.transcriber = transcriber
+        self.stopped.clear()
+        self.stream_thread = threading.Thread(target=self._stream_audio, daemon=True)
+        self.stream_thread.start()
+
+    def _audio(self):
+        """Yield microphone audio while active and silent keep-alive frames while idle"""
+        idle_since = time.monotonic()
+        while not self.stopped.is_set():
+            if not self.active.is_set():
+                woken = self.wake.wait(KEEPALIVE_INTERVAL)
+                self.wake.clear()
+                if woken:
+                    continue
+                if time.monotonic() - idle_since > MAX_IDLE:
+                    log_time("Armed session idle for too long, disconnecting")
+                    return
+                yield SILENCE
+                continue
+
+            microphone = aai.extras.MicrophoneStream(sample_rate=16_000)
+            try:
+                for chunk in microphone:
+                    if not self.active.is_set() or self.stopped.is_set():
+                        break
+                    yield chunk
+            finally:
+                microphone.close()
+            idle_since = time.monotonic()
+
+    def _stream_audio(self):
+        """Stream audio until the session is stopped or idles out"""
+        try:
+            self.transcriber.stream(self._audio())
+        except Exception as e:
+            log_time(f"Streaming error: {e}")
+            self.stop_recording()
+            return
+        if not self.stopped.is_set():
+            # Idled out: release the connection, the next toggle reconnects
+            self.transcriber.close()
+
+    def start_recording(self):
+        """Switch the armed session over to the microphone"""
+        try:
+            log_time("Starting transcription")
+            if self.transcriber is None or self.stopped.is_set():
+                self.arm()
+
+            self.is_running = True
+            self.active.set()
+            self.wake.set()
+
+            # Update i3status
+            self.i3status_file.write_text("recording🎤")
+            refresh_i3status()
+
+            self.timer_thread = threading.Thread(target=self._stop_after_timeout, daemon=True)
+            self.timer_thread.start()
+
+            notify('Voice Typing', 'Real-time transcription started')
+            log_time("Transcription started successfully")
+            return True
+
+        except Exception as e:
+            log_time(f"Error starting transcription: {e}")
+            notify('Voice Typing Error', f"Failed to start transcription: {e}", replace=False)
+            self.stop_recording()
+            return False
+
+    def on_close(self):
+        """Release the microphone when the server ends the session, e.g. a normal close"""
+        was_running = self.is_running
+        super().on_close()
+        self.active.clear()
+        self.wake.set()
+        if was_running:
+            # stop_recording wasn't called, so the indicator is still up
+            self.i3status_file.unlink(missing_ok=True)
+            refresh_i3status()
+
+    def _stop_after_timeout(self):
+        """Stop recording after 2 minutes"""
+        # Wakes early when stopped, so this thread doesn't outlive the recording
+        if not self.stopped.wait(120) and self.is_running:  # 2 minutes = 120 seconds
+            log_time("Maximum recording time (2 minutes) reached")
+            self.stop_recording()
+
+    def stop_recording(self):
+        """Stop sending microphone audio and close the session to flush final transcripts"""
+        self.active.clear()
+        self.stopped.set()
+        self.wake.set()
+        super().stop_recording()
+
 def main():
     manager = TranscriptionManager()
     
     if manager.pid_file.exists():
-        # Stop recording if already running
+        # The running process stops and cleans up on SIGTERM
         try:
             pid = int(manager.pid_file.read_text().strip())
             os.kill(pid, signal.SIGTERM)
         except (ProcessLookupError, ValueError) as e:
             log_time(f"Warning when stopping: {e}")
-        manager.stop_recording()
+            manager.stop_recording()
     else:
         # Start new recording
-        manager.start_recording()
-        try:
-            # Keep the main thread alive
-            while manager.is_running:
-                time.sleep(0.1)
-        except KeyboardInterrupt:
-            manager.stop_recording()
+        asyncio.run(manager.run())
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+import os
+import socket
+import sys
+from pathlib import Path
+
+SOCKET_PATH = Path(os.getenv('XDG_RUNTIME_DIR', '/tmp')) / 'record-assembly.sock'
+
+def serve():
+    """Keep an AssemblyAI session armed and toggle it for every client command"""
+    # Imported here so `toggle` clients don't pay for importing assemblyai
+    from record_assembly import TranscriptionDaemon, log_time
+
+    daemon = TranscriptionDaemon()
+
+    # Listen before connecting, so presses during a slow connect queue up instead of failing
+    SOCKET_PATH.unlink(missing_ok=True)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(str(SOCKET_PATH))
+    server.listen()
+    log_time(f"Daemon listening on {SOCKET_PATH}")
+
+    try:
+        daemon.arm()
+    except Exception as e:
+        # Not fatal: the first toggle connects instead
+        log_time(f"Error arming session: {e}")
+
+    while True:
+        conn, _ = server.accept()
+        with conn:
+            try:
+                command = conn.makefile('rb').readline().strip()
+                if command != b'toggle':
+                    conn.sendall(b"error: unknown command\n")
+                    continue
+                if not daemon.is_running:
+                    if daemon.start_recording():
+                        conn.sendall(b"recording\n")
+                    else:
+                        conn.sendall(b"error: failed to start transcription\n")
+                    continue
+                daemon.stop_recording()
+                conn.sendall(b"stopped\n")
+            except Exception as e:
+                log_time(f"Error handling command: {e}")
+                continue
+        # Connect the next session after replying, off the hotkey's critical path
+        try:
+            daemon.arm()
+        except Exception as e:
+            log_time(f"Error arming session: {e}")
+
+def toggle():
+    """Send a toggle to the running daemon and return its reply"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(str(SOCKET_PATH))
+        client.sendall(b"toggle\n")
+        return client.makefile('rb').readline().decode().strip()
+
+def main():
+    if sys.argv[1:] == ['toggle']:
+        try:
+            print(toggle())
+        except (FileNotFoundError, ConnectionRefusedError):
+            sys.exit("daemon not running (start it with: systemctl --user start record-assembly)")
+    else:
+        serve()
+
+if __name__ == '__main__':
+    main()
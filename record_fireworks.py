@@ -1,187 +1,478 @@
 #!/usr/bin/env python3
 import os
 import sys
+import json
+import queue
 import signal
+import socket
+import struct
 import subprocess
+import threading
+import uuid
+import itertools
 import requests
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException, Timeout
+from urllib3.connection import HTTPConnection
 from datetime import datetime
+from config import CACHE_DIR, load_api_key
+from desktop import notify, refresh_i3status, replace_text, type_text
+
+SAMPLE_RATE = 16000  # Whisper's native input rate
+CHANNELS = 1
+CHUNK_SIZE = 4096  # Bytes per read from arecord (~128ms of PCM16 @ 16kHz mono)
+BYTES_PER_SECOND = SAMPLE_RATE * CHANNELS * 2
+SHORT_CLIP_BYTES = 160_000  # ~5s of PCM16 @ 16kHz mono
+UTTERANCE_EWMA_ALPHA = 0.2  # Weight of the latest utterance in the running average
+WHISPER_ENDPOINTS = {
+    "whisper-v3-turbo": "https://audio-turbo.us-virginia-1.direct.fireworks.ai/v1/audio/transcriptions",
+    "whisper-v3": "https://audio-prod.us-virginia-1.direct.fireworks.ai/v1/audio/transcriptions",
+}
+STREAMING_URL = "wss://audio-streaming.us-virginia-1.direct.fireworks.ai/v1/audio/transcriptions/streaming"
 
 def log_time(message):
     """Log message with timestamp"""
     timestamp = datetime.now().strftime('%H:%M:%S.%f')[:-3]
     print(f"[{timestamp}] {message}")
 
+def wav_header(data_size=None):
+    """Build a PCM16 WAV header, for a stream of unknown length if data_size is None"""
+    block_align = CHANNELS * 2
+    riff_size = 0xFFFFFFFF if data_size is None else 36 + data_size
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', riff_size, b'WAVE',
+        b'fmt ', 16, 1, CHANNELS, SAMPLE_RATE, SAMPLE_RATE * block_align, block_align, 16,
+        b'data', 0xFFFFFFFF if data_size is None else data_size,
+    )
+
+def multipart_stream(boundary, chunks, get_fields):
+    """Yield a multipart/form-data body whose WAV file part is streamed from chunks
+
+    The form fields go after the file part, so get_fields() can depend on how
+    much audio was recorded.
+    """
+    yield (
+        f'--{boundary}\r\n'
+        'Content-Disposition: form-data; name="file"; filename="recording.wav"\r\n'
+        'Content-Type: audio/wav\r\n\r\n'
+    ).encode()
+    yield wav_header()
+    yield from chunks
+    yield b'\r\n'
+    for name, value in get_fields().items():
+        yield (
+            f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+            f'{value}\r\n'
+        ).encode()
+    yield f'--{boundary}--\r\n'.encode()
+
+class KeepAliveAdapter(HTTPAdapter):
+    """HTTPAdapter whose pooled sockets use TCP_NODELAY and SO_KEEPALIVE"""
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = HTTPConnection.default_socket_options + [
+            (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+        ]
+        super().init_poolmanager(*args, **kwargs)
+
+class StreamingTranscriber:
+    """Type transcripts from Fireworks' streaming ASR while the user is speaking"""
+    def __init__(self, api_key):
+        self.api_key = api_key
+        self.segments = {}
+        self.typed = ""
+
+    def run(self, chunks):
+        """Send PCM chunks over a WebSocket and return the final transcript"""
+        import websocket  # Only needed in streaming mode
+
+        ws = websocket.create_connection(
+            f"{STREAMING_URL}?language=en",
+            header={"Authorization": self.api_key},
+            timeout=30
+        )
+        # Silence can last longer than any sane read timeout
+        ws.settimeout(None)
+        receiver = threading.Thread(target=self._receive, args=(ws,))
+        receiver.start()
+        try:
+            for chunk in chunks:
+                ws.send(chunk, opcode=websocket.ABNF.OPCODE_BINARY)
+            ws.send(json.dumps({"checkpoint_id": "final"}))
+            receiver.join(timeout=30)
+        finally:
+            ws.close()
+        return self.typed
+
+    def _receive(self, ws):
+        """Apply segment updates until the final checkpoint is acknowledged"""
+        import websocket
+
+        while True:
+            try:
+                message = ws.recv()
+            except (websocket.WebSocketException, OSError):
+                return
+            data = json.loads(message)
+            for segment in data.get('segments', []):
+                self.segments[segment['id']] = segment['text'].strip()
+            self._type_delta()
+            if data.get('checkpoint_id') == 'final':
+                return
+
+    def _type_delta(self):
+        """Type only what changed since the last update, erasing revised words"""
+        text = ' '.join(self.segments[i] for i in sorted(self.segments) if self.segments[i])
+        common = len(os.path.commonprefix([self.typed, text]))
+        replace_text(len(self.typed) - common, text[common:])
+        if text != self.typed:
+            log_time(f"Partial: {text}")
+        self.typed = text
+
 class AudioRecorder:
     def __init__(self):
         self.home = Path.home()
         self.pid_file = self.home / '.recordpid'
-        self.recording_dir = self.home / '.voice-type'
-        self.recording_file = self.recording_dir / 'recording.wav'
         self.i3status_file = Path('/tmp/voice_typing_active')
+        self.recording_file = self.home / '.voice-type' / 'recording.wav'
+        self.keep_recording = os.getenv('KEEP_RECORDING') == '1'  # Save the last recording for debugging
         self.audio_input = os.getenv('AUDIO_INPUT', 'hw:0,6')  # Make audio input configurable
         self.max_duration = 120  # Maximum recording duration in seconds
+        # Forces one model; otherwise short utterances use turbo and long ones whisper-v3
+        self.model = os.getenv('WHISPER_MODEL')
+        # Average utterance length, in seconds, below which turbo is predicted to suffice
+        self.short_utterance_seconds = os.getenv('SHORT_UTTERANCE_SECONDS', '4')
+        # Running average of utterance length, used to predict the next one
+        self.profile_file = CACHE_DIR / 'utterance-seconds'
+        self.utterance_ewma = self.load_utterance_ewma()
+        self.streaming = os.getenv('FIREWORKS_STREAMING') == '1'  # Type partial transcripts over a WebSocket
         self.api_key = self.read_api_key()
-        
+        self.process = None
+        self.is_recording = False
+        self.audio_queue = queue.Queue()
+        self.stop_event = threading.Event()
+        self.bytes_captured = 0
+        # Called from the reader thread when arecord exits, e.g. on hitting --duration
+        self.on_capture_end = None
+        # Capture, upload and status workers, reused across recordings in the daemon
+        self.executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix='voice-type')
+
+        # Keep one TLS connection to the API host alive across recordings (see voice_typed.py)
+        self.session = requests.Session()
+        self.session.mount('https://', KeepAliveAdapter(pool_connections=1, pool_maxsize=1))
+
         if not self.api_key:
-            print("Error: FIREWORKS_API_KEY is not set in ~/.zshenv")
-            sys.exit(1)
+            sys.exit("Error: FIREWORKS_API_KEY is not set in ~/.zshenv")
+        if self.model and self.model not in WHISPER_ENDPOINTS:
+            sys.exit(f"Error: WHISPER_MODEL must be one of: {', '.join(WHISPER_ENDPOINTS)}")
+        try:
+            self.short_utterance_seconds = float(self.short_utterance_seconds)
+        except ValueError:
+            sys.exit(f"Error: SHORT_UTTERANCE_SECONDS must be a number, got {self.short_utterance_seconds!r}")
 
     def read_api_key(self):
-        zshenv_path = self.home / '.zshenv'
-        if zshenv_path.exists():
-            with open(zshenv_path, 'r') as f:
-                for line in f:
-                    if line.startswith('export FIREWORKS_API_KEY='):
-                        return line.split('=', 1)[1].strip().strip("'\"")
-        return None
+        return load_api_key('FIREWORKS_API_KEY')
+
+    def load_utterance_ewma(self):
+        try:
+            return float(self.profile_file.read_text())
+        except (FileNotFoundError, ValueError):
+            # No history yet: assume the common case of a short command
+            return 0.0
+
+    def update_utterance_ewma(self, seconds):
+        """Fold the latest utterance length into the running average and persist it"""
+        # Clamped so a single long dictation can't push the next few short commands off turbo
+        seconds = min(seconds, 2 * self.short_utterance_seconds)
+        self.utterance_ewma += UTTERANCE_EWMA_ALPHA * (seconds - self.utterance_ewma)
+        self.profile_file.parent.mkdir(parents=True, exist_ok=True)
+        self.profile_file.write_text(f"{self.utterance_ewma:.2f}")
+
+    def choose_model(self, short):
+        """Turbo for short utterances, full whisper-v3 for long ones, unless WHISPER_MODEL is set"""
+        if self.model:
+            return self.model
+        return "whisper-v3-turbo" if short else "whisper-v3"
 
     def start_recording(self):
-        """Start recording audio"""
+        """Start recording audio and streaming it to the transcription API"""
         start_time = time.time()
         log_time("Starting recording process")
+        self.audio_queue = queue.Queue()
+        self.stop_event.clear()
+        self.bytes_captured = 0
+        self.captured_chunks = []
+        self.capture_failed = False
+        # Pick the model up front, based on past utterances, so the upload can stream
+        self.predicted_short = self.utterance_ewma < self.short_utterance_seconds
         try:
-            self.recording_dir.mkdir(parents=True, exist_ok=True)
-            
+            # Raw PCM16 on stdout, so the upload can start before recording ends
             cmd = [
                 'arecord',
                 f'--device={self.audio_input}',
-                '--format=cd',
-                str(self.recording_file),
-                f'--duration={self.max_duration}'
+                '--format=S16_LE',
+                f'--rate={SAMPLE_RATE}',
+                f'--channels={CHANNELS}',
+                '--file-type=raw',
+                f'--duration={self.max_duration}',
+                '-'
             ]
-            
+
             log_time(f"Executing command: {' '.join(cmd)}")
-            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            
-            # Check if process started successfully
-            time.sleep(0.1)
-            if process.poll() is not None:
-                error = process.stderr.read().decode()
-                log_time(f"Error starting recording: {error}")
-                subprocess.run(['notify-send', 'Voice Typing Error', f"Failed to start recording: {error}"])
-                return
-            
-            self.pid_file.write_text(str(process.pid))
-            
-            self.i3status_file.write_text("recording🎤")
-            subprocess.run(['killall', '-USR1', 'i3status'], check=False)
-            
+            self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            # Don't wait to see whether arecord survives startup: the reader
+            # thread reports a failure if it exits before producing any audio
+            self.is_recording = True
+
+            # Submitted first so the reader's failure path can always wait for it
+            self.status_future = self.executor.submit(self._show_status)
+            self.reader_future = self.executor.submit(self._read_audio)
+            self.upload_future = self.executor.submit(self._upload_audio)
+
             duration = time.time() - start_time
-            log_time(f"Recording started. PID: {process.pid} (took {duration:.2f}s)")
-            subprocess.run(['notify-send', 'Voice Typing', 'Recording started. Speak now.'])
-            
+            log_time(f"Recording started. PID: {self.process.pid} (took {duration:.2f}s)")
+            return True
+
         except Exception as e:
             log_time(f"Error starting recording: {e}")
-            subprocess.run(['notify-send', 'Voice Typing Error', f"Failed to start recording: {e}"])
+            notify('Voice Typing Error', f"Failed to start recording: {e}", replace=False)
+            return False
 
-    def stop_recording(self):
-        """Stop recording and transcribe the audio"""
-        if not self.pid_file.exists():
+    def _show_status(self):
+        """Write the PID/indicator files and notify, in the background while arecord starts"""
+        if self.capture_failed:
             return
-        
+        self.pid_file.write_text(str(os.getpid()))
+        self.i3status_file.write_text("recording🎤")
+        refresh_i3status()
+        notify('Voice Typing', 'Recording started. Speak now.')
+
+    def wait_for_status(self):
+        try:
+            self.status_future.result()
+        except Exception as e:
+            log_time(f"Error updating status: {e}")
+
+    def clear_status(self):
+        """Remove the PID/indicator files and tell i3status"""
+        self.pid_file.unlink(missing_ok=True)
+        self.i3status_file.unlink(missing_ok=True)
+        refresh_i3status()
+
+    def _read_audio(self):
+        """Pump PCM chunks from arecord's stdout into the upload queue"""
+        try:
+            for chunk in iter(lambda: self.process.stdout.read(CHUNK_SIZE), b''):
+                self.bytes_captured += len(chunk)
+                self.audio_queue.put(chunk)
+                if self.keep_recording:
+                    self.captured_chunks.append(chunk)
+        except Exception as e:
+            log_time(f"Error reading audio: {e}")
+        finally:
+            if self.is_recording and self.bytes_captured == 0:
+                # arecord died on startup: nothing to stop or transcribe
+                self.capture_failed = True
+                self.is_recording = False
+                error = self.process.stderr.read().decode().strip()
+                log_time(f"Error starting recording: {error}")
+                # Let a status task already in progress finish, so it can't
+                # recreate the files or replace the error notification
+                self.wait_for_status()
+                self.clear_status()
+                notify('Voice Typing Error', f"Failed to start recording: {error}", replace=False)
+            # Sentinel ends the upload body; also covers arecord hitting --duration
+            self.audio_queue.put(None)
+            self.stop_event.set()
+            if self.on_capture_end:
+                self.on_capture_end()
+
+    def _upload_audio(self):
+        """Stream queued audio to the API while recording is still in progress"""
+        first = self.audio_queue.get()
+        if first is None:
+            log_time("No audio captured, skipping transcription")
+            return None
+        chunks = itertools.chain([first], iter(self.audio_queue.get, None))
+        if self.streaming:
+            # Already typed as it arrived
+            self.transcribe_streaming(chunks)
+            return None
+        # Most utterances are short commands for turbo; long dictation goes to whisper-v3
+        return self.transcribe_audio(chunks, self.choose_model(self.predicted_short))
+
+    def stop_recording(self):
+        """Stop recording and type the transcript once the upload completes"""
         start_time = time.time()
         log_time("Stopping recording")
-        
+        self.is_recording = False
+
+        if self.process.poll() is None:
+            self.process.terminate()
+            log_time(f"Sent SIGTERM to process {self.process.pid}")
+        self.reader_future.result()
+
+        # Don't let a late status write recreate the files after they are removed
+        self.wait_for_status()
+        self.clear_status()
+
+        log_time(f"Recorded audio size: {self.bytes_captured/1024/1024:.2f}MB")
+        if self.bytes_captured == 0:
+            # A capture failure has already been reported by the reader thread
+            if not self.capture_failed:
+                log_time("Error: Recording is empty")
+                notify('Voice Typing Error', 'Recording is empty', replace=False)
+        else:
+            notify('Voice Typing', 'Transcribing audio...')
+
+        text = self.upload_future.result()
+        if text:
+            self.write_transcript(text)
+        if self.keep_recording:
+            self.save_recording()
+        if self.bytes_captured:
+            self.update_utterance_ewma(self.bytes_captured / BYTES_PER_SECOND)
+
+        duration = time.time() - start_time
+        log_time(f"Stop recording completed (took {duration:.2f}s)")
+
+    def save_recording(self):
+        """Write the captured audio to recording_file, after the transcript is typed"""
+        self.recording_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.recording_file, 'wb') as f:
+            f.write(wav_header(self.bytes_captured))
+            f.writelines(self.captured_chunks)
+        self.captured_chunks = []
+        log_time(f"Recording saved to {self.recording_file}")
+
+    def record(self):
+        """Record until asked to stop (SIGTERM or max duration), then transcribe"""
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stop_event.set())
+        if not self.start_recording():
+            return
+        self.stop_event.wait()
+        self.stop_recording()
+
+    def request_stop(self):
+        """Ask the running recorder process to stop and transcribe"""
         try:
             pid = int(self.pid_file.read_text().strip())
             os.kill(pid, signal.SIGTERM)
-            log_time(f"Sent SIGTERM to process {pid}")
+            log_time(f"Sent SIGTERM to recorder {pid}")
         except (ProcessLookupError, ValueError) as e:
+            # Stale PID file left behind by a recorder that died
             log_time(f"Warning: {e}")
+            self.pid_file.unlink(missing_ok=True)
+            self.i3status_file.unlink(missing_ok=True)
         except Exception as e:
             log_time(f"Error stopping recording: {e}")
-        
-        self.pid_file.unlink(missing_ok=True)
-        self.i3status_file.unlink(missing_ok=True)
-        subprocess.run(['killall', '-USR1', 'i3status'], check=False)
-        
-        if self.recording_file.exists():
-            file_size = self.recording_file.stat().st_size
-            log_time(f"Recording file size: {file_size/1024/1024:.2f}MB")
-            
-            if file_size > 0:
-                text = self.transcribe_audio()
-                if text:
-                    self.write_transcript(text)
-            else:
-                log_time("Error: Recording file is empty")
-                subprocess.run(['notify-send', 'Voice Typing Error', 'Recording file is empty'])
-            self.recording_file.unlink(missing_ok=True)
-        
-        duration = time.time() - start_time
-        log_time(f"Stop recording completed (took {duration:.2f}s)")
 
-    def transcribe_audio(self):
-        """Transcribe audio using Fireworks Whisper V3 API"""
+    def transcription_fields(self, model):
+        """Form fields for the transcription request, chosen once recording has ended"""
+        fields = {
+            "model": model,
+            "temperature": "0",
+            "vad_model": "silero",
+            # Skips the language detection pass
+            "language": "en",
+        }
+        # Short clips are almost all speech, so VAD would be a wasted forward pass
+        if self.bytes_captured < SHORT_CLIP_BYTES:
+            fields.pop('vad_model')
+        return fields
+
+    def transcribe_audio(self, chunks, model):
+        """Transcribe streamed audio using the Fireworks Whisper API"""
         start_time = time.time()
-        log_time("Starting transcription")
-        subprocess.run(['notify-send', 'Voice Typing', 'Transcribing audio...'])
-        
+        log_time(f"Starting transcription with {model}")
+
         try:
-            with open(self.recording_file, 'rb') as f:
-                log_time("Sending request to Fireworks API")
-                response = requests.post(
-                    # "https://audio-turbo.us-virginia-1.direct.fireworks.ai/v1/audio/transcriptions",
-                    "https://audio-prod.us-virginia-1.direct.fireworks.ai/v1/audio/transcriptions",
-                    headers={"Authorization": f"Bearer {self.api_key}"},
-                    files={"file": f},
-                    data={
-                        # "model": "whisper-v3-turbo",
-                        "model": "whisper-v3",
-                        "temperature": "0",
-                        "vad_model": "silero",
-                        "language": "en",
-                    },
-                    timeout=30  # Set timeout to 30 seconds
-                )
-            
+            boundary = uuid.uuid4().hex
+            log_time("Streaming request to Fireworks API")
+            # A generator body is sent with chunked transfer encoding as audio arrives
+            response = self.session.post(
+                WHISPER_ENDPOINTS[model],
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": f"multipart/form-data; boundary={boundary}",
+                },
+                data=multipart_stream(boundary, chunks, lambda: self.transcription_fields(model)),
+                timeout=30  # Set timeout to 30 seconds
+            )
+
             api_duration = time.time() - start_time
             log_time(f"API request completed (took {api_duration:.2f}s)")
-            
+
             response.raise_for_status()
             result = response.json()
             text = result.get('text', '').strip()
-            
+
             total_duration = time.time() - start_time
             log_time(f"Transcription completed (total time: {total_duration:.2f}s)")
             return text
-            
+
         except Timeout:
             error_msg = "Transcription timed out after 30 seconds"
             log_time(error_msg)
-            subprocess.run(['notify-send', 'Voice Typing Error', error_msg])
+            notify('Voice Typing Error', error_msg, replace=False)
         except RequestException as e:
             error_msg = f"Transcription failed: {str(e)}"
             log_time(error_msg)
-            subprocess.run(['notify-send', 'Voice Typing Error', error_msg])
+            notify('Voice Typing Error', error_msg, replace=False)
         except Exception as e:
             error_msg = f"Unexpected error during transcription: {str(e)}"
             log_time(error_msg)
-            subprocess.run(['notify-send', 'Voice Typing Error', error_msg])
+            notify('Voice Typing Error', error_msg, replace=False)
         return None
 
+    def transcribe_streaming(self, chunks):
+        """Transcribe audio using the Fireworks streaming API, typing as results arrive"""
+        start_time = time.time()
+        log_time("Starting streaming transcription")
+
+        try:
+            text = StreamingTranscriber(self.api_key).run(chunks)
+            total_duration = time.time() - start_time
+            log_time(f"Streaming transcription completed (total time: {total_duration:.2f}s)")
+            print(f"Transcribed text: {text}")
+        except ImportError:
+            error_msg = "Streaming mode requires the websocket-client package"
+            log_time(error_msg)
+            notify('Voice Typing Error', error_msg, replace=False)
+        except Exception as e:
+            error_msg = f"Streaming transcription failed: {str(e)}"
+            log_time(error_msg)
+            notify('Voice Typing Error', error_msg, replace=False)
+
     def write_transcript(self, text):
-        """Write transcript using xdotool"""
+        """Type the transcript into the focused window"""
         if not text:
             return
-        
+
         start_time = time.time()
         log_time("Writing transcript")
-        subprocess.run(['xdotool', 'type', '--clearmodifiers', text])
+        type_text(text)
         duration = time.time() - start_time
         log_time(f"Transcript written (took {duration:.2f}s)")
         print(f"Transcribed text: {text}")
 
 def main():
+    if os.getenv('VOICE_TYPED', '1') == '1':
+        # Hand the toggle to the long-lived daemon, forking it on first use
+        import voice_typed
+        log_time(f"voice-typed: {voice_typed.toggle()}")
+        return
+
     recorder = AudioRecorder()
-    
+
     if recorder.pid_file.exists():
-        recorder.stop_recording()
+        recorder.request_stop()
     else:
-        recorder.start_recording()
+        recorder.record()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
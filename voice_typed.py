@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+import os
+import select
+import socket
+import sys
+import traceback
+from pathlib import Path
+
+SOCKET_PATH = Path(os.getenv('XDG_RUNTIME_DIR', '/tmp')) / 'voice-typed.sock'
+LOG_FILE = Path('/tmp/voice_typed_log.txt')
+
+def serve(server):
+    """Toggle a single long-lived AudioRecorder for every client command"""
+    from record_fireworks import AudioRecorder, log_time
+    from desktop import notify
+
+    # The recorder owns the requests.Session, so its TLS connection stays warm
+    try:
+        recorder = AudioRecorder()
+    except SystemExit as e:
+        # Misconfigured (e.g. no API key): stdout is the log file, so tell the user directly
+        notify('Voice Typing Error', str(e.code), replace=False)
+        reply_error(server, e.code)
+        raise
+    # The reader thread pokes this when arecord exits, so the loop can finish
+    # a recording that hit the duration limit without waiting for a toggle
+    capture_ended, wake = socket.socketpair()
+    recorder.on_capture_end = lambda: wake.send(b'\0')
+    log_time(f"Daemon listening on {SOCKET_PATH}")
+
+    serving = True
+    while serving:
+        readable, _, _ = select.select([server, capture_ended], [], [])
+        if server in readable:
+            conn, _ = server.accept()
+            with conn:
+                try:
+                    serving = handle(recorder, conn)
+                except Exception as e:
+                    log_time(f"Error handling command: {e}")
+        if capture_ended in readable:
+            capture_ended.recv(4096)
+            # Only a recording whose arecord has exited on its own; a toggle handled
+            # above has either stopped it or started a new one with a fresh stop_event
+            if recorder.is_recording and recorder.stop_event.is_set():
+                log_time("Maximum recording duration reached")
+                try:
+                    recorder.stop_recording()
+                except Exception as e:
+                    log_time(f"Error stopping recording: {e}")
+
+    server.close()
+    SOCKET_PATH.unlink(missing_ok=True)
+    log_time("Daemon stopped")
+
+def reply_error(server, message):
+    """Answer the client that started the daemon when it can't serve commands"""
+    server.settimeout(5)
+    try:
+        conn, _ = server.accept()
+    except socket.timeout:
+        return
+    with conn:
+        conn.makefile('rb').readline()
+        conn.sendall(f"error: {message}\n".encode())
+
+def handle(recorder, conn):
+    """Execute one command read from a client connection; False once told to quit"""
+    command = conn.makefile('rb').readline().strip()
+    if command == b'quit':
+        # Type whatever was being recorded before going away
+        if recorder.is_recording:
+            recorder.stop_recording()
+        conn.sendall(b"quitting\n")
+        return False
+    if command != b'toggle':
+        conn.sendall(b"error: unknown command\n")
+        return True
+
+    if recorder.is_recording:
+        # Blocks until the transcript has been typed
+        recorder.stop_recording()
+        conn.sendall(b"stopped\n")
+    elif recorder.start_recording():
+        conn.sendall(b"recording\n")
+    else:
+        conn.sendall(b"error: failed to start recording\n")
+    return True
+
+def spawn_daemon():
+    """Bind the socket, then fork a detached daemon that serves it"""
+    SOCKET_PATH.unlink(missing_ok=True)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(str(SOCKET_PATH))
+    # Listening before the fork lets the caller connect without waiting for the daemon
+    server.listen()
+
+    pid = os.fork()
+    if pid == 0:
+        os.setsid()
+        if os.fork() == 0:
+            log = open(LOG_FILE, 'a', buffering=1)
+            devnull = os.open(os.devnull, os.O_RDONLY)
+            os.dup2(devnull, 0)
+            os.dup2(log.fileno(), 1)
+            os.dup2(log.fileno(), 2)
+            sys.stdout = sys.stderr = log
+            status = 1
+            try:
+                serve(server)
+                status = 0
+            except BaseException:
+                # os._exit skips the interpreter's own report, so log the crash here
+                traceback.print_exc()
+                SOCKET_PATH.unlink(missing_ok=True)
+            finally:
+                os._exit(status)
+        os._exit(0)
+
+    server.close()
+    os.waitpid(pid, 0)
+
+def connect():
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(str(SOCKET_PATH))
+    except OSError:
+        client.close()
+        raise
+    return client
+
+def send(command):
+    """Send a command to the running daemon and return its reply"""
+    with connect() as client:
+        client.sendall(command.encode() + b"\n")
+        return client.makefile('rb').readline().decode().strip()
+
+def toggle():
+    """Send a toggle to the daemon and return its reply, starting it on first use"""
+    try:
+        return send('toggle')
+    except (FileNotFoundError, ConnectionRefusedError):
+        spawn_daemon()
+        return send('toggle')
+
+def main():
+    if sys.argv[1:] == ['quit']:
+        # Never spawns a daemon just to stop it
+        try:
+            print(send('quit'))
+        except (FileNotFoundError, ConnectionRefusedError):
+            print("not running")
+    else:
+        print(toggle())
+
+if __name__ == '__main__':
+    main()